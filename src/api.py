@@ -5,19 +5,36 @@ Task 2 - FastAPI API to serve the RAG chatbot.
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass, replace
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from cachetools import TTLCache
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 import lancedb
+import numpy as np
 from pydantic_ai import Agent, RunContext, Tool
+from pydantic_ai.models.google import GoogleModelSettings
 
 from lancedb.pydantic import LanceModel, Vector
 
 from .config import LANCEDB_URI
-from .ingestion import EmbeddingClient, TranscriptChunk   # reuse Task 0/1
+from .ingestion import EMBEDDING_DIM, EmbeddingClient   # reuse Task 0/1
+from .query_cache import QueryCache, make_query_key
+from .rerank import cosine_topk
 from fastapi import HTTPException
 
 # for VG
@@ -25,6 +42,8 @@ from fastapi import HTTPException
 from typing import Literal, List, Dict
 from uuid import uuid4
 
+logger = logging.getLogger(__name__)
+
 # ---------------- Task 4: memory support helper ----------------
 
 # OLD placeholder:
@@ -33,11 +52,12 @@ from uuid import uuid4
 #     ...
 #
 # NEW implementation using the existing Agent + RAG
-async def generate_rag_reply(conversation_text: str) -> str:
+async def generate_rag_reply(conversation_text: str, deps: RAGDeps | None = None) -> str:
     """
     Use the existing RAG agent to generate a reply given the full conversation text.
     """
-    deps = get_deps()
+    if deps is None:
+        deps = await get_deps()
     result = await agent.run(conversation_text, deps=deps)
     return result.output
 
@@ -48,13 +68,194 @@ async def generate_rag_reply(conversation_text: str) -> str:
 class RAGDeps:
     table: any
     embedder: EmbeddingClient
+    qa_cache: any = None
+    # Per-request: chunks retrieved for the user's message before the agent runs
+    prefetched_chunks: Optional[List[RetrievedChunk]] = None
+
+
+# ---------- Semantic cache of past (question -> reply) pairs ----------
+
+QA_CACHE_TABLE = "qa_cache"
+# Cosine distance below this (= similarity >= 0.95) counts as "same question"
+QA_CACHE_MAX_DISTANCE = 0.05
+# Cached replies older than this are ignored, and deleted on the next flush
+QA_CACHE_TTL_SECONDS = 24 * 3600
+# New replies are buffered and written in one add() per this many rows
+# (every add() creates a new Lance fragment + table version)
+QA_CACHE_FLUSH_SIZE = 32
+
+
+class QACacheEntry(LanceModel):
+    # Hash of the conversation before the question (see make_context_key)
+    context_key: str
+    query_text: str
+    query_vector: Vector(EMBEDDING_DIM)
+    reply: str
+    ts: float
+
+
+# Replies not yet written to the qa_cache table
+_qa_pending: List[dict] = []
+_qa_pending_lock = threading.Lock()
+
+
+def make_context_key(history: List[ChatMessage]) -> str:
+    """
+    Hash of the turns the agent sees before the latest user message.
+
+    Replies depend on the conversation, not only on the last question, so a
+    cached reply is only reused after the exact same preceding turns. Every
+    first message shares the key of the empty conversation.
+    """
+    prior = "\n".join(
+        f"{m.role}: {m.content}" for m in history[-2 * MAX_HISTORY_TURNS:-1]
+    )
+    return hashlib.blake2b(prior.encode("utf-8")).hexdigest()
+
+
+def lookup_cached_reply(deps: RAGDeps, context_key: str, query_embedding: List[float]) -> Optional[str]:
+    """
+    Return a previously generated reply for a semantically identical question
+    asked after the same conversation, if any.
+    The cache is best-effort: lookup errors are logged and count as a miss.
+    """
+    if deps.qa_cache is None:
+        return None
+
+    try:
+        return _lookup_cached_reply(deps, context_key, query_embedding)
+    except Exception:
+        logger.warning("qa_cache lookup failed", exc_info=True)
+        return None
+
+
+def _lookup_cached_reply(deps: RAGDeps, context_key: str, query_embedding: List[float]) -> Optional[str]:
+    with _qa_pending_lock:
+        pending = [r for r in _qa_pending if r["context_key"] == context_key]
+    if pending:
+        idx, sims = cosine_topk(
+            np.asarray(query_embedding, dtype=np.float32),
+            np.asarray([r["query_vector"] for r in pending], dtype=np.float32),
+            1,
+        )
+        if 1.0 - sims[0] < QA_CACHE_MAX_DISTANCE:
+            return pending[idx[0]]["reply"]
+
+    cutoff = time.time() - QA_CACHE_TTL_SECONDS
+    rows = (
+        deps.qa_cache
+        .search(query_embedding, vector_column_name="query_vector")
+        .distance_type("cosine")
+        .where(f"context_key = '{context_key}' AND ts > {cutoff}", prefilter=True)
+        .limit(1)
+        .to_list()
+    )
+    if rows and rows[0]["_distance"] < QA_CACHE_MAX_DISTANCE:
+        return rows[0]["reply"]
+    return None
+
+
+def store_cached_reply(
+    deps: RAGDeps,
+    context_key: str,
+    query_text: str,
+    query_embedding: List[float],
+    reply: str,
+) -> None:
+    """
+    Buffer a reply for the qa_cache table (no I/O here). Once
+    QA_CACHE_FLUSH_SIZE replies are buffered, a background task writes them.
+    Must be called from the event loop.
+    """
+    if deps.qa_cache is None:
+        return
+    with _qa_pending_lock:
+        _qa_pending.append({
+            "context_key": context_key,
+            "query_text": query_text,
+            "query_vector": query_embedding,
+            "reply": reply,
+            "ts": time.time(),
+        })
+        flush_due = len(_qa_pending) >= QA_CACHE_FLUSH_SIZE
+    if flush_due:
+        schedule_cache_flush(deps)
+
+
+# Running background flush (a reference is kept so it isn't garbage collected)
+_qa_flush_task: asyncio.Task | None = None
+
+
+def schedule_cache_flush(deps: RAGDeps) -> None:
+    global _qa_flush_task
+    if _qa_flush_task is not None and not _qa_flush_task.done():
+        return  # rows buffered meanwhile go out with the next flush
+    _qa_flush_task = asyncio.get_running_loop().create_task(
+        asyncio.to_thread(flush_cached_replies, deps)
+    )
+
+
+def flush_cached_replies(deps: RAGDeps) -> None:
+    """
+    Write the buffered replies in one add(), drop expired rows and compact
+    the table so the flat-scan lookup stays small. Errors are only logged.
+    """
+    if deps.qa_cache is None:
+        return
+    with _qa_pending_lock:
+        rows = _qa_pending[:]
+        _qa_pending.clear()
+    if not rows:
+        return
+
+    try:
+        deps.qa_cache.add(rows)
+        deps.qa_cache.delete(f"ts < {time.time() - QA_CACHE_TTL_SECONDS}")
+        deps.qa_cache.optimize()
+    except Exception:
+        logger.warning("qa_cache flush of %d replies failed", len(rows), exc_info=True)
+
+
+# Deps are built once per process (at startup) and shared by every request,
+# instead of reconnecting to LanceDB + reloading the embedding model on each call.
+_DEPS: RAGDeps | None = None
+_DEPS_LOCK = asyncio.Lock()
 
 
-def get_deps() -> RAGDeps:
+def _build_deps() -> RAGDeps:
     db = lancedb.connect(LANCEDB_URI)
     table = db.open_table("transcript_chunks")
+    table_dim = table.schema.field("vector").type.list_size
+    if table_dim != EMBEDDING_DIM:
+        # e.g. the old 768-dim Gemini vectors: every search would fail
+        raise RuntimeError(
+            f"transcript_chunks holds {table_dim}-dim vectors, but the embedding model "
+            f"produces {EMBEDDING_DIM}-dim ones. Re-run the ingestion: python -m src.ingestion"
+        )
+    qa_cache = None
+    if QA_CACHE_TABLE in db.table_names():
+        qa_cache = db.open_table(QA_CACHE_TABLE)
+        if qa_cache.schema != QACacheEntry.to_arrow_schema():
+            # Written by an older version (other columns or embedding size):
+            # it's only a cache, so start it over
+            qa_cache = None
+    if qa_cache is None:
+        qa_cache = db.create_table(QA_CACHE_TABLE, schema=QACacheEntry, mode="overwrite")
     embedder = EmbeddingClient()
-    return RAGDeps(table=table, embedder=embedder)
+    return RAGDeps(table=table, embedder=embedder, qa_cache=qa_cache)
+
+
+async def get_deps() -> RAGDeps:
+    """
+    Return the shared RAGDeps, building them on first use.
+    The lock makes sure concurrent first requests only build them once.
+    """
+    global _DEPS
+    if _DEPS is None:
+        async with _DEPS_LOCK:
+            if _DEPS is None:
+                _DEPS = _build_deps()
+    return _DEPS
 
 
 class RetrievedChunk(BaseModel):
@@ -63,29 +264,83 @@ class RetrievedChunk(BaseModel):
     text: str
 
 
+# Cache of query -> (embedding, retrieved chunks) shared by all requests
+query_cache = QueryCache(max_size=2000, ttl_seconds=600)
+
+
+# How many candidates to fetch from the quantized index per returned chunk
+RERANK_FACTOR = 10
+
+
+def retrieve_chunks(deps: RAGDeps, query_embedding: List[float], limit: int = 5) -> list[RetrievedChunk]:
+    """
+    Vector search in the transcript_chunks table for an already-embedded query.
+
+    Fetches limit * RERANK_FACTOR candidates from the IVF_SQ index and
+    re-ranks them in-process with exact fp32 cosine similarity.
+    """
+    results = (
+        deps.table
+        .search(query_embedding, vector_column_name="vector")
+        .distance_type("cosine")  # must match the IVF_SQ index metric
+        .nprobes(20)
+        .select(["video_id", "chunk_index", "text", "vector"])
+        .limit(limit * RERANK_FACTOR)
+        .to_arrow()
+    )
+    if results.num_rows == 0:
+        return []
+
+    # Vectors go straight from Arrow into a (n, dim) float32 matrix,
+    # without building Python lists / pydantic models for them
+    query = np.asarray(query_embedding, dtype=np.float32)
+    candidates = (
+        results["vector"].combine_chunks().flatten().to_numpy()
+        .astype(np.float32, copy=False)
+        .reshape(results.num_rows, -1)
+    )
+    top_idx, _ = cosine_topk(query, candidates, limit)
+
+    rows = results.select(["video_id", "chunk_index", "text"]).to_pylist()
+    # Rows come from our own table, so skip pydantic validation
+    return [RetrievedChunk.model_construct(**rows[i]) for i in top_idx]
+
+
+def prefetch_chunks(deps: RAGDeps, query_text: str, query_embedding: List[float]) -> list[RetrievedChunk]:
+    """
+    Retrieve chunks for the user's message up front (reusing its embedding),
+    and remember them in the query cache so search_knowledge can reuse them.
+    """
+    key = make_query_key(query_text)
+    cached = query_cache.get(key)
+    if cached is not None:
+        _, chunks = cached
+        return chunks
+
+    chunks = retrieve_chunks(deps, query_embedding)
+    query_cache.put(key, query_embedding, chunks)
+    return chunks
+
+
 async def search_knowledge(
     ctx: RunContext[RAGDeps],
     query: str,
 ) -> list[RetrievedChunk]:
     deps = ctx.deps
 
-    query_embedding = deps.embedder.embed(query)
+    key = make_query_key(query)
+    cached = query_cache.get(key)
+    if cached is not None:
+        _, chunks = cached
+        return chunks
 
-    results = (
-        deps.table
-        .search(query_embedding, vector_column_name="vector")
-        .limit(5)
-        .to_pydantic(TranscriptChunk)
-    )
+    # A search for the user's message itself is a query_cache hit (prefetched);
+    # anything else the agent asks for gets embedded here
+    query_embedding = deps.embedder.embed(query)
+    chunks = retrieve_chunks(deps, query_embedding)
 
-    return [
-        RetrievedChunk(
-            video_id=row.video_id,
-            chunk_index=row.chunk_index,
-            text=row.text,
-        )
-        for row in results
-    ]
+    query_cache.put(key, query_embedding, chunks)
+    return chunks
 
 
 search_knowledge_tool = Tool(
@@ -136,19 +391,141 @@ Guidelines:
 #MODEL_ID = "google-gla:gemini-2.0-flash"
 MODEL_ID = "google-gla:gemini-2.5-flash"
 
+# Latency-oriented settings: gemini-2.5-flash "thinks" before answering by
+# default, which adds seconds to time-to-first-token. Our answers are grounded
+# in the retrieved chunks, so we turn thinking off and cap the reply length.
+CHAT_MODEL_SETTINGS = GoogleModelSettings(
+    google_thinking_config={"thinking_budget": 0},
+    max_tokens=1024,
+)
+
+# Tags are a short comma-separated list
+TAGS_MODEL_SETTINGS = GoogleModelSettings(max_tokens=512)
+
 agent = Agent(
     model=MODEL_ID,
     system_prompt=SYSTEM_PROMPT,
     deps_type=RAGDeps,
     tools=[search_knowledge_tool],
+    model_settings=CHAT_MODEL_SETTINGS,
 )
 
 
+@agent.system_prompt(dynamic=True)
+def prefetched_context(ctx: RunContext[RAGDeps]) -> str:
+    """
+    Add the chunks already retrieved for the user's message to the prompt,
+    so the agent usually doesn't need a search_knowledge round-trip.
+    """
+    chunks = ctx.deps.prefetched_chunks
+    if not chunks:
+        return ""
+
+    passages = "\n\n".join(
+        f"[{c.video_id} #{c.chunk_index}]\n{c.text}" for c in chunks
+    )
+    return (
+        "Transcript passages already retrieved for the user's latest message "
+        "(you can call `search_knowledge` if you need something else):\n\n"
+        + passages
+    )
+
+
 # ---------- 2. FastAPI app ----------
 
 app = FastAPI(title="Youtuber RAG API")
 
 
+# Background thread that does the actual log writes
+_log_listener: QueueListener | None = None
+
+
+def setup_queue_logging() -> None:
+    """
+    Route all logging through a queue so request handlers only enqueue records;
+    the existing root handlers (e.g. console) run in a listener thread.
+
+    Skipped under the Azure Functions host: its handlers read the invocation
+    context of the calling thread, which a listener thread doesn't have, so
+    App Insights traces would no longer be tied to their invocation.
+    The log level is left as configured.
+    """
+    global _log_listener
+    if _log_listener is not None or os.getenv("FUNCTIONS_WORKER_RUNTIME"):
+        return
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    if not handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handlers = [handler]
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(QueueHandler(log_queue))
+
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+# Max time spent on the Gemini warm-up call at startup
+WARMUP_TIMEOUT_SECONDS = 5
+
+
+def warm_retrieval(deps: RAGDeps) -> None:
+    # Loads the embedding model weights, reads the Lance files into the
+    # OS page cache and compiles the numba re-rank kernel
+    retrieve_chunks(deps, deps.embedder.embed("warmup"))
+
+
+async def warm_agent(deps: RAGDeps) -> None:
+    # Opens the HTTPS connection (DNS + TLS) to Gemini
+    await asyncio.wait_for(agent.run("ping", deps=deps), timeout=WARMUP_TIMEOUT_SECONDS)
+
+
+async def warm_up(deps: RAGDeps) -> None:
+    """
+    Run one throwaway retrieval and one Gemini call on cold start, so the
+    first real request doesn't pay for them. Failures are only logged.
+    """
+    results = await asyncio.gather(
+        asyncio.to_thread(warm_retrieval, deps),
+        warm_agent(deps),
+        return_exceptions=True,
+    )
+    for name, result in zip(("retrieval", "agent"), results):
+        if isinstance(result, BaseException):
+            logger.warning("Warm-up of %s failed: %r", name, result)
+
+
+@app.on_event("startup")
+async def init_deps():
+    setup_queue_logging()
+    # Open LanceDB + embedder once when the app starts
+    deps = await get_deps()
+    await warm_up(deps)
+
+
+@app.on_event("shutdown")
+async def flush_qa_cache():
+    # Write replies still buffered for the qa_cache table
+    if _qa_flush_task is not None:
+        await _qa_flush_task
+    if _DEPS is not None:
+        await asyncio.to_thread(flush_cached_replies, _DEPS)
+
+
+@app.on_event("shutdown")
+async def stop_logging():
+    # Flush any queued log records
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
 @app.get("/")
 async def root():
     return {"status": "ok", "message": "App is running"}
@@ -167,6 +544,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses (e.g. /chat with its history) on the wire
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
 # ---------- Task 4: Chat models with memory ----------
 
 # OLD simple models (Task 2):
@@ -187,6 +567,9 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     session_id: str
     message: str
+    # Speculative prefetch from the frontend (user still typing): generate and
+    # cache the reply, but don't add anything to the session history
+    speculative: bool = False
 
 
 class ChatResponse(BaseModel):
@@ -194,8 +577,87 @@ class ChatResponse(BaseModel):
     history: List[ChatMessage]
 
 
-# In-memory store of histories (per session_id)
-histories: Dict[str, List[ChatMessage]] = {}
+# In-memory store of histories (per session_id).
+# Bounded: least recently used sessions are dropped, and idle ones expire after 1h.
+# TTLCache counts the TTL from when an entry was last *set* (get() doesn't
+# refresh it), so the helpers below re-set the entry on every use.
+MAX_SESSIONS = 10_000
+SESSION_TTL_SECONDS = 3600
+histories: TTLCache[str, List[ChatMessage]] = TTLCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+
+# One lock per session so concurrent requests for the same session
+# don't interleave their history appends.
+session_locks: TTLCache[str, asyncio.Lock] = TTLCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+
+# Only the last N turns (user + assistant) are sent to the agent
+MAX_HISTORY_TURNS = 10
+
+
+def get_session_lock(session_id: str) -> asyncio.Lock:
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+    # Re-set to restart the TTL for active sessions
+    session_locks[session_id] = lock
+    return lock
+
+
+def get_or_create_history(session_id: str) -> List[ChatMessage]:
+    history = histories.get(session_id)
+    if history is None:
+        history = []
+    # Re-set to restart the TTL for active sessions
+    histories[session_id] = history
+    return history
+
+
+def build_conversation_text(history: List[ChatMessage]) -> str:
+    # Build context for RAG: combine the most recent history messages
+    return "\n".join(
+        f"{m.role}: {m.content}" for m in history[-2 * MAX_HISTORY_TURNS:]
+    )
+
+
+async def embed_message(deps: RAGDeps, user_message: str) -> Optional[List[float]]:
+    """
+    Embed the user message once, off the event loop. Whitespace-only messages
+    can't be embedded: they get None and skip the reply cache and prefetch.
+    """
+    if not user_message.strip():
+        return None
+    return await asyncio.to_thread(deps.embedder.embed, user_message)
+
+
+async def lookup_or_prefetch(
+    deps: RAGDeps,
+    context_key: str,
+    user_message: str,
+    query_embedding: Optional[List[float]],
+) -> tuple[Optional[str], Optional[RAGDeps]]:
+    """
+    Probe the reply cache and retrieve chunks for the user's message at the
+    same time (both are local LanceDB queries).
+
+    Returns (cached reply, None) on a hit; otherwise (None, deps for the agent
+    run) with the chunks ready to be put in its prompt.
+    """
+    if query_embedding is None:
+        return None, deps
+
+    # Retrieve for the latest message only (not the whole history)
+    prefetch = asyncio.create_task(
+        asyncio.to_thread(prefetch_chunks, deps, user_message, query_embedding)
+    )
+    try:
+        reply_text = await asyncio.to_thread(lookup_cached_reply, deps, context_key, query_embedding)
+    except BaseException:
+        prefetch.cancel()
+        raise
+    if reply_text is not None:
+        prefetch.cancel()
+        return reply_text, None
+
+    return None, replace(deps, prefetched_chunks=await prefetch)
 
 
 # ---------- Task 4: Chat endpoint with memory ----------
@@ -246,26 +708,243 @@ async def chat(req: ChatRequest) -> ChatResponse:
     session_id = req.session_id
     user_message = req.message
 
-    # Get or create history for this session
-    history = histories.setdefault(session_id, [])
-    history.append(ChatMessage(role="user", content=user_message))
+    if req.speculative:
+        return await speculative_chat(session_id, user_message)
 
-    # Build context for RAG: combine history messages
-    conversation_text = "\n".join(
-        f"{m.role}: {m.content}" for m in history
-    )
+    async with get_session_lock(session_id):
+        # Get or create history for this session
+        history = get_or_create_history(session_id)
+        history.append(ChatMessage(role="user", content=user_message))
+
+        try:
+            deps = await get_deps()
+
+            # Embed the user message once: used for the semantic cache probe
+            # and reused by search_knowledge if the agent searches for it.
+            query_embedding = await embed_message(deps, user_message)
+            reply_text = await reply_for_message(deps, history, query_embedding)
+        except Exception:
+            logger.exception("Error in /chat")
+            raise HTTPException(status_code=500, detail="Internal error in chat backend")
+
+        # Store assistant reply
+        history.append(ChatMessage(role="assistant", content=reply_text))
+
+        return ChatResponse(reply=reply_text, history=list(history))
+
+
+async def speculative_chat(session_id: str, user_message: str) -> ChatResponse:
+    """
+    Warm the semantic reply cache for a message the user hasn't sent yet.
+    The reply is generated as if the message came after the session's current
+    turns, so when it is sent /chat finds it in qa_cache right away.
+    """
+    history = list(histories.get(session_id, [])) + [ChatMessage(role="user", content=user_message)]
+    try:
+        deps = await get_deps()
+        query_embedding = await embed_message(deps, user_message)
+        reply_text = await reply_for_message(deps, history, query_embedding)
+    except Exception:
+        logger.exception("Error in speculative /chat")
+        raise HTTPException(status_code=500, detail="Internal error in chat backend")
+
+    return ChatResponse(reply=reply_text, history=[])
+
+
+async def reply_for_message(
+    deps: RAGDeps,
+    history: List[ChatMessage],
+    query_embedding: Optional[List[float]],
+    agent_limit: asyncio.Semaphore | None = None,
+) -> str:
+    """
+    Semantic cache probe, then (on a miss) the RAG agent, then cache the reply.
+    `history` ends with the user message being answered.
+    `agent_limit` optionally caps how many agent runs happen at once.
+    """
+    user_message = history[-1].content
+    conversation_text = build_conversation_text(history)
+    context_key = make_context_key(history)
+
+    reply_text, request_deps = await lookup_or_prefetch(deps, context_key, user_message, query_embedding)
+    if reply_text is not None:
+        return reply_text
+
+    # Use existing RAG logic with recent conversation as input
+    if agent_limit is None:
+        reply_text = await generate_rag_reply(conversation_text, deps=request_deps)
+    else:
+        async with agent_limit:
+            reply_text = await generate_rag_reply(conversation_text, deps=request_deps)
+
+    if query_embedding is not None:
+        store_cached_reply(deps, context_key, user_message, query_embedding, reply_text)
+    return reply_text
+
+
+# ---------- Batch chat (several messages in one request) ----------
+
+# Max number of agent (Gemini) runs in flight for one /chat/batch call
+BATCH_MAX_CONCURRENCY = 4
+
+
+class BatchChatResponse(ChatResponse):
+    # Set (with an empty reply) when this message failed; other items are unaffected
+    error: Optional[str] = None
+
+
+@app.post("/chat/batch", response_model=List[BatchChatResponse])
+async def chat_batch(reqs: List[ChatRequest]) -> List[BatchChatResponse]:
+    """
+    Answer several chat messages at once (same or different sessions).
+    All messages are embedded in one batch, then retrieval and the agent runs
+    happen concurrently -- also for messages of the same session, which are
+    each answered after the conversation as it was before the batch (like
+    questions asked at the same moment). Several messages of one session are
+    therefore recorded as a single turn: all questions, then all answers.
+    A failing message gets an `error` entry instead of failing the batch.
+    """
+    if not reqs:
+        return []
 
     try:
-        # Use existing RAG logic with full conversation as input
-        reply_text = await generate_rag_reply(conversation_text)
-    except Exception as e:
-        print("❌ Error in /chat:", repr(e))
+        deps = await get_deps()
+        # Whitespace-only messages can't be embedded (see embed_message)
+        texts = [r.message for r in reqs if r.message.strip()]
+        vectors = iter(await asyncio.to_thread(deps.embedder.embed_batch, texts) if texts else [])
+        embeddings = [next(vectors) if r.message.strip() else None for r in reqs]
+    except Exception:
+        logger.exception("Error in /chat/batch")
         raise HTTPException(status_code=500, detail="Internal error in chat backend")
 
-    # Store assistant reply
-    history.append(ChatMessage(role="assistant", content=reply_text))
+    agent_limit = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    responses: List[Optional[BatchChatResponse]] = [None] * len(reqs)
+
+    # Request positions per session, in request order
+    by_session: Dict[str, List[int]] = {}
+    for i, req in enumerate(reqs):
+        by_session.setdefault(req.session_id, []).append(i)
+
+    async def answer_session(session_id: str, indices: List[int]) -> None:
+        async with get_session_lock(session_id):
+            history = get_or_create_history(session_id)
+            before = list(history)
+
+            results = await asyncio.gather(
+                *(
+                    reply_for_message(
+                        deps,
+                        before + [ChatMessage(role="user", content=reqs[i].message)],
+                        embeddings[i],
+                        agent_limit,
+                    )
+                    for i in indices
+                ),
+                return_exceptions=True,
+            )
+
+            for result in results:
+                if isinstance(result, BaseException):
+                    logger.error("Error in /chat/batch", exc_info=result)
+
+            if len(indices) == 1:
+                history.append(ChatMessage(role="user", content=reqs[indices[0]].message))
+                if not isinstance(results[0], BaseException):
+                    history.append(ChatMessage(role="assistant", content=results[0]))
+            else:
+                # None of the answers saw the others, so don't store them as
+                # consecutive turns that seem to build on each other
+                answers = [
+                    f"**{reqs[i].message}**\n\n"
+                    + ("(no answer: internal error)" if isinstance(result, BaseException) else result)
+                    for i, result in zip(indices, results)
+                ]
+                history.append(ChatMessage(
+                    role="user", content="\n".join(reqs[i].message for i in indices)
+                ))
+                history.append(ChatMessage(role="assistant", content="\n\n".join(answers)))
+
+            for i, result in zip(indices, results):
+                if not isinstance(result, BaseException):
+                    responses[i] = BatchChatResponse(reply=result, history=list(history))
+
+    results = await asyncio.gather(
+        *(answer_session(sid, indices) for sid, indices in by_session.items()),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            logger.error("Error in /chat/batch", exc_info=result)
 
-    return ChatResponse(reply=reply_text, history=history)
+    return [
+        resp if resp is not None else BatchChatResponse(
+            reply="",
+            history=list(histories.get(req.session_id, [])),
+            error="Internal error in chat backend",
+        )
+        for req, resp in zip(reqs, responses)
+    ]
+
+
+# ---------- Streaming chat (Server-Sent Events) ----------
+
+def sse_event(data: str, event: str | None = None) -> str:
+    """
+    Format one Server-Sent Event. Multi-line data becomes several `data:` lines.
+    """
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest) -> StreamingResponse:
+    """
+    Same as /chat, but streams the reply as it is generated (text/event-stream).
+    The stream ends with a `done` event (or an `error` event).
+
+    Behind AsgiFunctionApp (function_app.py) the Functions host buffers the
+    whole response, so clients only get the events once the reply is done.
+    """
+    session_id = req.session_id
+    user_message = req.message
+
+    async def event_stream():
+        async with get_session_lock(session_id):
+            history = get_or_create_history(session_id)
+            history.append(ChatMessage(role="user", content=user_message))
+            conversation_text = build_conversation_text(history)
+            context_key = make_context_key(history)
+
+            try:
+                deps = await get_deps()
+
+                query_embedding = await embed_message(deps, user_message)
+                reply_text, request_deps = await lookup_or_prefetch(
+                    deps, context_key, user_message, query_embedding
+                )
+
+                if reply_text is not None:
+                    yield sse_event(reply_text)
+                else:
+                    parts: List[str] = []
+                    async with agent.run_stream(conversation_text, deps=request_deps) as result:
+                        async for delta in result.stream_text(delta=True):
+                            parts.append(delta)
+                            yield sse_event(delta)
+                    reply_text = "".join(parts)
+                    if query_embedding is not None:
+                        store_cached_reply(deps, context_key, user_message, query_embedding, reply_text)
+            except Exception:
+                logger.exception("Error in /chat/stream")
+                yield sse_event("Internal error in chat backend", event="error")
+                return
+
+            # Store assistant reply
+            history.append(ChatMessage(role="assistant", content=reply_text))
+            yield sse_event("", event="done")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @app.get("/health")
@@ -273,6 +952,14 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters for the search_knowledge query cache.
+    """
+    return query_cache.stats()
+
+
 # ---------- Task 4: History endpoint ----------
 
 @app.get("/history/{session_id}", response_model=List[ChatMessage])
@@ -299,6 +986,10 @@ class TagsResponse(BaseModel):
     tags: str  # comma-separated list: keyword1,keyword2,...
 
 
+# Splits the model's tag output on commas and/or newlines
+_TAG_SPLIT_RE = re.compile(r"[,\n]+")
+
+
 @app.post("/video/description", response_model=DescriptionResponse)
 async def video_description(req: VideoRequest) -> DescriptionResponse:
     """
@@ -319,12 +1010,12 @@ Requirements:
 - Do NOT include hashtags.
 """
 
-    deps = get_deps()
+    deps = await get_deps()
     try:
         result = await agent.run(prompt, deps=deps)
         description = result.output.strip()
-    except Exception as e:
-        print("❌ Error in /video/description:", repr(e))
+    except Exception:
+        logger.exception("Error in /video/description")
         raise HTTPException(status_code=500, detail="Failed to generate description")
 
     return DescriptionResponse(video_id=video_id, description=description)
@@ -350,18 +1041,17 @@ Rules:
 - Each tag should be a short phrase (1–3 words).
 """
 
-    deps = get_deps()
+    deps = await get_deps()
     try:
-        result = await agent.run(prompt, deps=deps)
+        result = await agent.run(prompt, deps=deps, model_settings=TAGS_MODEL_SETTINGS)
         raw = result.output.strip()
-    except Exception as e:
-        print("❌ Error in /video/tags:", repr(e))
+    except Exception:
+        logger.exception("Error in /video/tags")
         raise HTTPException(status_code=500, detail="Failed to generate tags")
 
     # Basic cleanup to enforce comma-separated format without spaces
-    # Convert newlines to commas, split, strip, re-join
-    parts = [p.strip() for p in raw.replace("\n", ",").split(",") if p.strip()]
-    cleaned = ",".join(parts)
+    # Split on commas/newlines in one pass, strip, drop empties, re-join
+    cleaned = ",".join(filter(None, (p.strip() for p in _TAG_SPLIT_RE.split(raw))))
 
     return TagsResponse(video_id=video_id, tags=cleaned)
 
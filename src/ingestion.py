@@ -1,6 +1,6 @@
 # src/ingestion.py
 """
-Task 0 - Data ingestion into LanceDB (using Gemini embeddings).
+Task 0 - Data ingestion into LanceDB (using local sentence-transformers embeddings).
 
 LLM-assisted implementation: I've used an AI for scaffolding this file
 and then reviewed/modified it myself.
@@ -8,64 +8,90 @@ and then reviewed/modified it myself.
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import asyncio
+import math
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import List
 
 import lancedb
+import numpy as np
+import pyarrow as pa
 from lancedb.pydantic import LanceModel, Vector
 from pydantic import Field
 
-import google.generativeai as genai
+from sentence_transformers import SentenceTransformer
 
-from .config import LANCEDB_URI, GEMINI_API_KEY, BASE_DIR
+from .config import LANCEDB_URI, BASE_DIR
 
 
 # ----- 1. Define the LanceDB row model -----
 
 
+# BAAI/bge-small-en-v1.5 -> 384-dimensional vector
+# (changing the model/dimension requires re-running the ingestion)
+EMBEDDING_DIM = 384
+
+# Below this many rows a flat scan is fast anyway, and there is too little
+# data to train the IVF partitions.
+MIN_ROWS_FOR_INDEX = 256
+
+
 class TranscriptChunk(LanceModel):
     id: str
     video_id: str
     chunk_index: int
     text: str
-    # Gemini text-embedding-004 -> 768-dimensional vector
-    vector: Vector(768) = Field(description="Embedding vector for this chunk")
+    vector: Vector(EMBEDDING_DIM) = Field(description="Embedding vector for this chunk")
 
 
-# ----- 2. Embedding client wrapper (Gemini) -----
+# ----- 2. Embedding client wrapper (local sentence-transformers model) -----
 
 
 @dataclass
 class EmbeddingClient:
-    # Gemini embedding model
-    model: str = "models/text-embedding-004"
+    # Small BGE model, runs in-process on CPU (no network round-trip per query)
+    model: str = "BAAI/bge-small-en-v1.5"
+    _model: SentenceTransformer = field(init=False, repr=False)
 
     def __post_init__(self):
-        if not GEMINI_API_KEY:
-            raise RuntimeError(
-                "GEMINI_API_KEY is not set. "
-                "Set it in your environment or .env file."
-            )
-        genai.configure(api_key=GEMINI_API_KEY)
+        self._model = SentenceTransformer(self.model)
 
     def embed(self, text: str) -> List[float]:
         """
-        Call Gemini's embeddings API and return a list[float].
+        Embed a single text and return a list[float].
         """
         text = text.strip()
         if not text:
             raise ValueError("Cannot embed empty text")
 
-        resp = genai.embed_content(
-            model=self.model,
-            content=text,
-            # This param is optional, 768 is the default for text-embedding-004,
-            # but we make it explicit to match Vector(768)
-            task_type="SEMANTIC_SIMILARITY",
+        # Normalized vectors -> cosine similarity == dot product
+        vec = self._model.encode(text, normalize_embeddings=True, convert_to_numpy=True)
+        return vec.tolist()
+
+    def embed_batch(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
+        """
+        Embed many texts, `batch_size` at a time.
+        Returns the embeddings in the same order as `texts`.
+        """
+        batch = [t.strip() for t in texts]
+        if not all(batch):
+            raise ValueError("Cannot embed empty text")
+
+        vecs = self._model.encode(
+            batch,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
         )
-        # embed_content returns a dict with "embedding"
-        return resp["embedding"]
+        return vecs.tolist()
+
+    async def embed_batch_async(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async version of embed_batch: runs the model in a worker thread
+        so the event loop is not blocked.
+        """
+        return await asyncio.to_thread(self.embed_batch, texts)
 
 
 # ----- 3. Utility: load all text files under data/ -----
@@ -116,38 +142,39 @@ def chunk_text(text: str, max_tokens: int = 300) -> list[str]:
     """
     Very simple chunking: split on words and group into chunks
     of ~max_tokens words.
+
+    Slices the word list once per chunk instead of appending word by word.
     """
     words = text.split()
-    chunks: list[str] = []
-    current: list[str] = []
-
-    for w in words:
-        current.append(w)
-        if len(current) >= max_tokens:
-            chunks.append(" ".join(current))
-            current = []
-
-    if current:
-        chunks.append(" ".join(current))
-
-    return chunks
+    return [
+        " ".join(words[start:start + max_tokens])
+        for start in range(0, len(words), max_tokens)
+    ]
 
 
 # ----- 5. Main ingestion flow -----
 
 
-def ingest_transcripts():
+async def ingest_transcripts(batch_size: int = 100, max_concurrency: int = 4):
     # 5.1 Open LanceDB connection
     db = lancedb.connect(LANCEDB_URI)
 
     # 5.2 Get or create table
     table_name = "transcript_chunks"
+    schema = TranscriptChunk.to_arrow_schema()
+    table = None
     if table_name in db.table_names():
         table = db.open_table(table_name)
-    else:
+        if table.schema.field("vector").type != schema.field("vector").type:
+            # Embedded with another model (e.g. the old 768-dim Gemini vectors):
+            # those rows can't be searched with the new embeddings, start over
+            print(f"Recreating '{table_name}': vector size changed to {EMBEDDING_DIM}.")
+            table = None
+    if table is None:
         table = db.create_table(
             table_name,
             schema=TranscriptChunk,
+            mode="overwrite",
         )
 
     embedder = EmbeddingClient()
@@ -156,37 +183,98 @@ def ingest_transcripts():
     data_dir = BASE_DIR / "data"
     all_transcripts = load_transcripts(data_dir)
 
-    rows: list[TranscriptChunk] = []
-
+    # Collect all (video_id, idx, chunk) first so we can embed in batches
+    pending: list[tuple[str, int, str]] = []
     for video_id, full_text in all_transcripts:
         chunks = chunk_text(full_text, max_tokens=300)
         for idx, chunk in enumerate(chunks):
             if not chunk.strip():
                 continue
+            pending.append((video_id, idx, chunk))
+
+    batches = [
+        pending[start:start + batch_size]
+        for start in range(0, len(pending), batch_size)
+    ]
+
+    # Run the batches concurrently in worker threads, but cap how many run at once
+    semaphore = asyncio.Semaphore(max_concurrency)
 
+    async def embed_one(batch: list[tuple[str, int, str]]) -> list[list[float]] | None:
+        async with semaphore:
             try:
-                embedding = embedder.embed(chunk)
+                return await embedder.embed_batch_async([chunk for _, _, chunk in batch])
             except Exception as e:
-                print(f"[WARN] Failed to embed chunk {video_id}_{idx}: {e}")
-                continue
+                first_video, first_idx, _ = batch[0]
+                print(f"[WARN] Failed to embed batch starting at {first_video}_{first_idx}: {e}")
+                return None
+
+    all_embeddings = await asyncio.gather(*[embed_one(b) for b in batches])
+
+    # Build the columns directly instead of one TranscriptChunk model per row
+    ids: list[str] = []
+    video_ids: list[str] = []
+    chunk_indices: list[int] = []
+    texts: list[str] = []
+    vectors: list[list[float]] = []
+
+    for batch, embeddings in zip(batches, all_embeddings):
+        if embeddings is None:
+            continue
+
+        for (video_id, idx, chunk), embedding in zip(batch, embeddings):
+            ids.append(f"{video_id}_{idx}")
+            video_ids.append(video_id)
+            chunk_indices.append(idx)
+            texts.append(chunk)
+            vectors.append(embedding)
+
+    if not ids:
+        print("No transcript chunks found. Make sure there are .txt/.md files under the data/ folder.")
+        return
 
-            row = TranscriptChunk(
-                id=f"{video_id}_{idx}",
-                video_id=video_id,
-                chunk_index=idx,
-                text=chunk,
-                vector=embedding,
-            )
-            rows.append(row)
+    # 5.3 Add data to the table as a single Arrow RecordBatch
+    flat_vectors = np.asarray(vectors, dtype=np.float32).reshape(-1)
+    record_batch = pa.RecordBatch.from_arrays(
+        [
+            pa.array(ids, type=pa.string()),
+            pa.array(video_ids, type=pa.string()),
+            pa.array(chunk_indices, type=schema.field("chunk_index").type),
+            pa.array(texts, type=pa.string()),
+            pa.FixedSizeListArray.from_arrays(pa.array(flat_vectors), EMBEDDING_DIM),
+        ],
+        schema=schema,
+    )
+    table.add(record_batch)
+    print(f"Ingested {len(ids)} chunks into LanceDB table '{table_name}'.")
+
+    # 5.4 Build the ANN index so searches don't fall back to a flat scan
+    create_vector_index(table)
+
+
+def create_vector_index(table) -> None:
+    """
+    (Re)build an IVF_SQ cosine index on the `vector` column.
 
-    if not rows:
-        print("No transcript chunks found. Make sure there are .txt/.md files under the data/ folder.")
+    SQ (scalar quantization) stores each dimension as int8 inside the index,
+    so the index is ~4x smaller than fp32 and distance calculations move 4x
+    less memory. The API re-ranks the candidates with the full fp32 vectors
+    (rerank.cosine_topk) to recover the small recall loss.
+    """
+    num_rows = table.count_rows()
+    if num_rows < MIN_ROWS_FOR_INDEX:
+        print(f"Skipping vector index: only {num_rows} rows (need {MIN_ROWS_FOR_INDEX}).")
         return
 
-    # 5.3 Add data to the table
-    table.add(rows)
-    print(f"Ingested {len(rows)} chunks into LanceDB table '{table_name}'.")
+    table.create_index(
+        metric="cosine",
+        vector_column_name="vector",
+        index_type="IVF_SQ",
+        num_partitions=int(math.sqrt(num_rows)),
+        replace=True,
+    )
+    print(f"Built IVF_SQ index on '{table.name}' ({num_rows} rows).")
 
 
 if __name__ == "__main__":
-    ingest_transcripts()
\ No newline at end of file
+    asyncio.run(ingest_transcripts())
\ No newline at end of file
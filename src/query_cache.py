@@ -0,0 +1,87 @@
+# src/query_cache.py
+"""
+Small in-memory LRU + TTL cache for knowledge-base searches.
+
+Repeated questions skip both the embedding call and the
+LanceDB vector search.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+
+def make_query_key(query: str) -> str:
+    """
+    Normalize the query (strip + lowercase) and hash it into a cache key.
+    """
+    normalized = query.strip().lower()
+    return hashlib.blake2b(normalized.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a time-to-live per entry.
+
+    Each entry is stored as (embedding, results, timestamp).
+    """
+
+    def __init__(self, max_size: int = 2000, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, Tuple[List[float], Any, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[List[float], Any]]:
+        """
+        Return (embedding, results) for key, or None on a miss / expired entry.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            embedding, results, ts = entry
+            if time.monotonic() - ts > self.ttl_seconds:
+                # Expired -> drop it and treat as a miss
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            # Mark as most recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return embedding, results
+
+    def put(self, key: str, embedding: List[float], results: Any) -> None:
+        with self._lock:
+            self._data[key] = (embedding, results, time.monotonic())
+            self._data.move_to_end(key)
+            # Evict least recently used entries
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -16,7 +16,8 @@ from pydantic_ai import Agent, RunContext, Tool
 import lancedb
 
 from .config import LANCEDB_URI
-from .ingestion import EmbeddingClient, TranscriptChunk  # reuse from Task 0
+from .ingestion import EmbeddingClient  # reuse from Task 0
+from .query_cache import QueryCache, make_query_key
 
 
 # --- 1. Dependencies object for the agent ---
@@ -49,6 +50,10 @@ class RetrievedChunk(BaseModel):
     text: str
 
 
+# Repeated questions reuse the previous embedding + search results
+query_cache = QueryCache(max_size=2000, ttl_seconds=600)
+
+
 # IMPORTANT: ctx (RunContext) must be the FIRST parameter for takes_ctx=True
 async def search_knowledge(
     ctx: RunContext[RAGDeps],
@@ -59,6 +64,13 @@ async def search_knowledge(
     """
     deps = ctx.deps
 
+    # 0) Serve repeated queries from the cache
+    key = make_query_key(query)
+    cached = query_cache.get(key)
+    if cached is not None:
+        _, chunks = cached
+        return chunks
+
     # 1) Embed the query using the same embedder as ingestion
     query_embedding = deps.embedder.embed(query)
 
@@ -66,21 +78,26 @@ async def search_knowledge(
     results = (
         deps.table
         .search(query_embedding, vector_column_name="vector")
+        .distance_type("cosine")  # must match the IVF_SQ index metric
+        .nprobes(20)
+        .refine_factor(10)  # re-rank top 10x candidates with fp32 vectors
+        .select(["video_id", "chunk_index", "text"])
         .limit(5)
-        .to_pydantic(TranscriptChunk)
+        .to_list()
     )
 
     # 3) Map to compact objects with only the fields the LLM needs
-    chunks: list[RetrievedChunk] = []
-    for row in results:
-        chunks.append(
-            RetrievedChunk(
-                video_id=row.video_id,
-                chunk_index=row.chunk_index,
-                text=row.text,
-            )
+    #    (plain dicts from our own table, so no need to re-validate)
+    chunks: list[RetrievedChunk] = [
+        RetrievedChunk.model_construct(
+            video_id=row["video_id"],
+            chunk_index=row["chunk_index"],
+            text=row["text"],
         )
+        for row in results
+    ]
 
+    query_cache.put(key, query_embedding, chunks)
     return chunks
 
 
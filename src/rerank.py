@@ -0,0 +1,45 @@
+# src/rerank.py
+"""
+Exact fp32 re-ranking of vector search candidates.
+
+LanceDB returns candidates from the (int8 quantized) IVF_SQ index; we then
+re-score them against the query with full-precision cosine similarity.
+
+The kernel is serial on purpose: it only sees ~50 candidates, and it is
+called from several threads at once (prefetch, qa_cache lookup, batches).
+numba's parallel kernels need a thread-safe threading layer (tbb/omp) for
+that; the fallback `workqueue` layer aborts the process on concurrent use.
+"""
+
+from __future__ import annotations
+
+import numba
+import numpy as np
+
+
+@numba.njit(fastmath=True, cache=True)
+def cosine_topk(q: np.ndarray, cands: np.ndarray, k: int):
+    """
+    Cosine similarity between `q` (dim,) and each row of `cands` (n, dim).
+
+    Returns (indices, similarities) of the top-k candidates, best first.
+    """
+    n, dim = cands.shape
+
+    q_norm = 0.0
+    for j in range(dim):
+        q_norm += q[j] * q[j]
+    q_norm = np.sqrt(q_norm)
+
+    sims = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        dot = 0.0
+        c_norm = 0.0
+        for j in range(dim):
+            dot += q[j] * cands[i, j]
+            c_norm += cands[i, j] * cands[i, j]
+        denom = q_norm * np.sqrt(c_norm)
+        sims[i] = dot / denom if denom > 0.0 else 0.0
+
+    idx = np.argsort(-sims)[:k]
+    return idx, sims[idx]
@@ -2,141 +2,454 @@
 """
 Streamlit frontend for the Youtuber RAG assistant (Task 2 & Task 4).
 """
+import json
 import os
-import requests
-import streamlit as st
-
-# for VG
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
+from pathlib import Path
+from types import SimpleNamespace
 import uuid
 
+import httpx
+import orjson
+import streamlit as st
+
 
 # --- Session handling for memory (VG / Task 4) ---
-# Original:
-# if "session_id" not in st.session_state:
-#     st.session_state.session_id = str(uuid.uuid4())# this is the end
 
-# New (same logic, just a bit cleaner)
 if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
-# this is the end
 
+# Serializes the check-then-update steps on session state below (history
+# spill, prefetch cache, prefetch counters). Only the script thread and its
+# widget callbacks touch that state -- the prefetch pool and warm-up threads
+# never read or write st.session_state -- so this only matters if a later
+# change lets other threads in. Uncontended, it costs next to nothing.
+if "state_lock" not in st.session_state:
+    st.session_state["state_lock"] = threading.Lock()
+
+
+# --- Backend configuration + shared HTTP client ---
+# Local Azure Functions by default. For the cloud backend set e.g.
+# BACKEND_URL=https://data-talks-ai-function-e0dhdmchdeawa8g2.swedencentral-01.azurewebsites.net
+
+@st.cache_resource
+def backend() -> SimpleNamespace:
+    """
+    Resolved once per process (not on every rerun): the backend URL and
+    one HTTP client (keep-alive + HTTP/2 pooling) shared by all sessions.
+    """
+    url = os.getenv(
+        "BACKEND_URL",
+        "http://127.0.0.1:7072"   # local default
+    )
+    # retries=2 retries failed connection attempts (not HTTP error statuses)
+    transport = httpx.HTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+    )
+    client = httpx.Client(
+        base_url=url,
+        timeout=120,
+        # httpx decompresses automatically (br needs the brotli package)
+        headers={"User-Agent": "streamlit-rag", "Accept-Encoding": "gzip, br"},
+        transport=transport,
+    )
+    return SimpleNamespace(url=url, client=client)
+
+
+B = backend()
+
+# Request bodies are encoded with orjson (faster than the stdlib json module)
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+@st.cache_resource
+def get_prefetch_pool() -> ThreadPoolExecutor:
+    # Background threads for speculative requests (shared by all sessions)
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+# Backend errors are reported as plain status codes / values instead of
+# raising, so a 429/503 doesn't build an exception + traceback each time.
+
+def post_json(path: str, payload: dict | list) -> tuple[int, bytes]:
+    r = B.client.post(path, content=orjson.dumps(payload), headers=JSON_HEADERS, timeout=120)
+    return r.status_code, r.content
+
+
+def post_speculative(session_id: str, message: str) -> int:
+    # The backend generates + caches the reply without touching the history
+    status, _ = post_json("/chat", {"session_id": session_id, "message": message, "speculative": True})
+    return status
+
+
+def stream_chat(payload, result: dict):
+    """
+    Call /chat/stream and yield the reply text as it arrives (for st.write_stream).
+    The backend sends Server-Sent Events: `data:` lines, then an `event: done`
+    (or `event: error`) at the end.
+
+    `result` is filled with "status" (HTTP status code), "done" once the
+    `done` event arrived (without it the reply was cut off) and, if the
+    backend reported a failure, "error".
+    """
+    with B.client.stream(
+        "POST",
+        "/chat/stream",
+        content=orjson.dumps(payload),
+        headers=JSON_HEADERS,
+        timeout=120,
+    ) as r:
+        result["status"] = r.status_code
+        if not r.is_success:
+            return
 
-# --- Backend URL configuration ---
+        event, data = None, []
+        for line in r.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data.append(line[len("data: "):])
+            elif line == "":
+                # Blank line = end of one event
+                if event == "error":
+                    result["error"] = "\n".join(data)
+                    return
+                if event == "done":
+                    result["done"] = True
+                    return
+                if event is None and data:
+                    yield "\n".join(data)
+                event, data = None, []
 
-# Original local FastAPI endpoint:
-# API_URL = "http://127.0.0.1:8000/chat"  # FastAPI endpoint
 
-# Original local Azure Functions endpoint:
-# API_URL = "http://127.0.0.1:7072/chat"
-# or "http://localhost:7072/chat"
+# Same question in the same session -> served from memory, no backend call
+REPLY_CACHE_TTL = 600
+REPLY_CACHE_MAX_ENTRIES = 256
 
-# For local development (Azure Functions on port 7072):
-#API_URL = "http://127.0.0.1:7072/chat" change it later 
 
-BACKEND_URL = os.getenv(
-    "BACKEND_URL",
-    "http://127.0.0.1:7072"   # local default
-)
-API_URL = f"{BACKEND_URL}/chat"
-def post_chat(payload):
-    r = requests.post(f"{BACKEND_URL}/chat", json=payload, timeout=120)
-    r.raise_for_status()
-    return r.json()
+def get_cached_reply(message: str) -> str | None:
+    entry = st.session_state.reply_cache.get(message)
+    if entry is None:
+        return None
+    reply, ts = entry
+    if time.time() - ts > REPLY_CACHE_TTL:
+        del st.session_state.reply_cache[message]
+        return None
+    return reply
 
 
+def cache_reply(message: str, reply: str) -> None:
+    cache = st.session_state.reply_cache
+    cache[message] = (reply, time.time())
+    cache.move_to_end(message)
+    while len(cache) > REPLY_CACHE_MAX_ENTRIES:
+        cache.popitem(last=False)
 
-# For cloud (Azure Function in swedencentral), uncomment this and comment out the line above:
-# API_URL = "https://data-talks-ai-function-e0dhdmchdeawa8g2.swedencentral-01.azurewebsites.net/chat"
 
+if "reply_cache" not in st.session_state:
+    st.session_state.reply_cache = OrderedDict()  # message -> (reply, timestamp)
 
 
 st.set_page_config(page_title="Youtuber RAG Chat", page_icon="🎥", layout="centered")
 
+
+def warm_backend():
+    # Wakes the Azure Function (cold start + RAG warm-up) and opens the
+    # connection while the user is still typing. Errors don't matter here.
+    try:
+        B.client.get("/health", timeout=5)
+    except httpx.HTTPError:
+        pass
+
+
+if "warmed" not in st.session_state:
+    threading.Thread(target=warm_backend, daemon=True).start()
+    st.session_state.warmed = True
+
 st.title("🎥 Youtuber RAG Assistant")
 st.write("Ask questions based on your course transcripts. The assistant answers like *The Youtuber*.")
 
 # Initialize chat history
+# Only the last MAX_VISIBLE_MESSAGES are kept (and re-rendered on each rerun);
+# older ones are spilled to .cache/<session_id>.jsonl
+MAX_VISIBLE_MESSAGES = 50
+HISTORY_DIR = Path(".cache")
+# Spill files of sessions that weren't cleared (tab closed) are deleted
+# once they haven't been written to for this long (checked every hour)
+HISTORY_FILE_TTL_SECONDS = 24 * 3600
+HISTORY_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def history_file() -> Path:
+    return HISTORY_DIR / f"{st.session_state.session_id}.jsonl"
+
+
+def prune_history_files() -> None:
+    cutoff = time.time() - HISTORY_FILE_TTL_SECONDS
+    for path in HISTORY_DIR.glob("*.jsonl"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass  # removed by another session in the meantime
+
+
+@st.cache_resource
+def start_history_pruner() -> threading.Thread:
+    # Once per process: prune at startup, then on a timer
+    def run():
+        while True:
+            prune_history_files()
+            time.sleep(HISTORY_PRUNE_INTERVAL_SECONDS)
+
+    thread = threading.Thread(target=run, daemon=True, name="history-pruner")
+    thread.start()
+    return thread
+
+
+start_history_pruner()
+
+
+def append_message(role: str, content: str) -> None:
+    messages = st.session_state.messages
+    with st.session_state["state_lock"]:
+        if len(messages) == messages.maxlen:
+            # The oldest message is about to be evicted -> save it to disk first
+            # Chat logs are private: owner-only directory and files
+            HISTORY_DIR.mkdir(mode=0o700, exist_ok=True)
+            oldest = messages[0]
+            fd = os.open(history_file(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            with os.fdopen(fd, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"role": oldest["role"], "content": oldest["content"]}) + "\n")
+        messages.append({"role": role, "content": content})
+
+
 if "messages" not in st.session_state:
-    st.session_state.messages = []  # list of dicts: {"role": "user"/"assistant", "content": "..."}
+    # dicts: {"role": "user"/"assistant", "content": "..."}
+    st.session_state.messages = deque(maxlen=MAX_VISIBLE_MESSAGES)
+
+# --- Speculative prefetch of a drafted question ---
+# st.chat_input gives us no keystroke events, so longer questions can be
+# drafted in the sidebar: when the draft changes (focus leaves the box or
+# Ctrl+Enter), the backend starts answering it in the background, and
+# "Send draft" then gets the cached reply.
+
+# Only the most recent drafts are remembered
+PREFETCH_MAX_ENTRIES = 8
+# How long sending a prefetched question waits for the prefetch to finish
+# before falling back to a normal (streamed) request
+PREFETCH_WAIT_SECONDS = 5
+
+if "pf_cache" not in st.session_state:
+    st.session_state.pf_cache = OrderedDict()  # hash(draft) -> Future
+    st.session_state.pf_stats = {"sent": 0, "prefetched": 0}
+
+
+def prefetch_draft():
+    draft = st.session_state.draft.strip()
+    with st.session_state["state_lock"]:
+        cache = st.session_state.pf_cache
+        if not draft or hash(draft) in cache:
+            return
+        # The draft was edited: earlier versions are stale. Drop the ones still
+        # waiting for a worker (cancel() is a no-op once a request is running).
+        for future in cache.values():
+            future.cancel()
+        cache[hash(draft)] = get_prefetch_pool().submit(
+            post_speculative, st.session_state.session_id, draft
+        )
+        while len(cache) > PREFETCH_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+
+st.sidebar.text_area("✍️ Draft a question", key="draft", on_change=prefetch_draft)
+send_draft = st.sidebar.button("Send draft")
+
+pf_stats = st.session_state.pf_stats
+if pf_stats["sent"]:
+    st.sidebar.caption(
+        f"Prefetched {pf_stats['prefetched']}/{pf_stats['sent']} questions "
+        f"({pf_stats['prefetched'] / pf_stats['sent']:.0%})"
+    )
+
+# Start over: new session on the backend and drop cached replies
+if st.sidebar.button("Clear chat"):
+    history_file().unlink(missing_ok=True)
+    st.session_state.messages = deque(maxlen=MAX_VISIBLE_MESSAGES)
+    st.session_state.session_id = str(uuid.uuid4())
+    st.session_state.pf_cache = OrderedDict()
+    st.session_state.reply_cache = OrderedDict()
+
+# Older (spilled) history is only read from disk when asked for
+if history_file().exists():
+    with st.expander("Older history", expanded=False):
+        if st.checkbox("Load older messages"):
+            with history_file().open(encoding="utf-8") as f:
+                for line in f:
+                    msg = json.loads(line)
+                    st.markdown(f"**{msg['role']}:** {msg['content']}")
 
 # Display existing chat history
-for msg in st.session_state.messages:
-    if msg["role"] == "user":
+# Consecutive messages from the same role are rendered as one block,
+# so each rerun sends fewer elements to the browser
+for role, group in groupby(st.session_state.messages, key=lambda m: m["role"]):
+    with st.chat_message(role):
+        st.markdown("\n\n---\n\n".join(m["content"] for m in group))
+
+def split_questions(text: str) -> list[str]:
+    """
+    Several questions pasted at once (one per line, each ending with "?")
+    are answered separately; anything else is one message.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) > 1 and all(line.endswith("?") for line in lines):
+        return lines
+    return [text]
+
+
+def answer_batch(questions: list[str]) -> None:
+    """
+    Answer several questions with one POST /chat/batch call. The backend
+    generates the replies concurrently (and records them as one turn in the
+    session history), so the wait is ~ the slowest question instead of the sum.
+    The replies are shown as separate chat messages.
+    """
+    to_ask = [q for q in questions if get_cached_reply(q) is None]
+    replies: dict[str, str] = {}
+
+    # Show the questions right away, each with a slot for its reply
+    slots = []
+    for q in questions:
         with st.chat_message("user"):
-            st.markdown(msg["content"])
-    else:
+            st.markdown(q)
         with st.chat_message("assistant"):
-            st.markdown(msg["content"])
+            slots.append(st.empty())
 
-# Chat input
-user_input = st.chat_input("Type your question here...")
+    if to_ask:
+        session_id = st.session_state.session_id
+        try:
+            with st.spinner(f"Answering {len(to_ask)} questions..."):
+                status, content = post_json(
+                    "/chat/batch",
+                    [{"session_id": session_id, "message": q} for q in to_ask],
+                )
+            if 200 <= status < 300:
+                for q, resp in zip(to_ask, orjson.loads(content)):
+                    if resp.get("error"):
+                        replies[q] = f"⚠️ Backend error: {resp['error']}"
+                    else:
+                        replies[q] = resp.get("reply") or "(No reply)"
+                        cache_reply(q, replies[q])
+            else:
+                replies = {q: f"⚠️ Backend error {status}" for q in to_ask}
+        except httpx.HTTPError as e:
+            replies = {q: f"(Request failed: {e})" for q in to_ask}
+
+    with st.session_state["state_lock"]:
+        pf_stats["sent"] += len(questions)
+
+    for q, slot in zip(questions, slots):
+        answer = replies.get(q) or get_cached_reply(q) or "(No reply)"
+        slot.markdown(answer)
+        append_message("user", q)
+        append_message("assistant", answer)
+
+
+def answer_question(question: str) -> None:
+    with st.session_state["state_lock"]:
+        pf_stats["sent"] += 1
+        pending: Future | None = st.session_state.pf_cache.pop(hash(question), None)
+        if pending is not None and not pending.cancelled():
+            pf_stats["prefetched"] += 1
 
-if user_input:
     # Add user message to history
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    append_message("user", question)
     with st.chat_message("user"):
-        st.markdown(user_input)
+        st.markdown(question)
 
-    # --- Call FastAPI backend (VG / Task 4) ---
+    # If this exact question was prefetched, give that request a moment to
+    # finish so the real one is a cache hit instead of a second generation.
+    # If it takes longer, just stream the reply as usual.
+    if pending is not None and not pending.cancelled():
+        try:
+            pending.result(timeout=PREFETCH_WAIT_SECONDS)
+        except Exception:
+            pass  # timed out or failed: the real request below takes over
 
-    # Old version (was outside the if-block and causing issues):
-    # payload = {
-    #     "session_id": st.session_state.session_id,
-    #     "message": user_input,
-    # }
-    #
-    # try:
-    #     resp = requests.post(API_URL, json=payload, timeout=60)
-    #     resp.raise_for_status()
-    #
-    #     data = resp.json()
-    #     answer = data.get("reply", "(No reply)")
-    #     backend_history = data.get("history", [])
-    #
-    # except requests.exceptions.RequestException as e:
-    #     answer = f"(Request failed: {e})"
-    #     backend_history = [] #till here
-
-    # New, fixed version (inside the if, with better error handling)
+    # --- Call FastAPI backend (VG / Task 4) ---
+    # Stream the reply token by token from /chat/stream
     payload = {
         "session_id": st.session_state.session_id,
-        "message": user_input,
+        "message": question,
     }
 
-    try:
-        resp = requests.post(API_URL, json=payload, timeout=60)
-
-        if not resp.ok:
-            # Show backend error details if status is not 2xx
-            answer = f"⚠️ Backend error {resp.status_code}"
-            backend_history = []
+    with st.chat_message("assistant"):
+        answer = get_cached_reply(question)
+        if answer is not None:
+            st.markdown(answer)
         else:
-            data = resp.json()
-            answer = data.get("reply", "(No reply)")
-            backend_history = data.get("history", [])
+            result: dict = {}
+            try:
+                streamed = st.write_stream(stream_chat(payload, result))
 
-    except requests.exceptions.RequestException as e:
-        answer = f"(Request failed: {e})"
-        backend_history = []
+                if result.get("status", 200) >= 300:
+                    # Show backend error details if status is not 2xx
+                    answer = f"⚠️ Backend error {result['status']}"
+                    st.markdown(answer)
+                elif "error" in result:
+                    answer = f"⚠️ Backend error: {result['error']}"
+                    st.markdown(answer)
+                elif not result.get("done"):
+                    # Connection dropped mid-reply: keep what arrived, don't cache it
+                    note = "⚠️ The reply was cut off (incomplete)."
+                    st.markdown(note)
+                    answer = f"{streamed}\n\n{note}" if streamed else note
+                else:
+                    answer = streamed or "(No reply)"
+                    cache_reply(question, answer)
+
+            except httpx.HTTPError as e:
+                answer = f"(Request failed: {e})"
+                st.markdown(answer)
+
+    # Store assistant message
+    append_message("assistant", answer)
 
-    # Show assistant message and store it
-    st.session_state.messages.append({"role": "assistant", "content": answer})
-    with st.chat_message("assistant"):
-        st.markdown(answer)
 
-    # Optional: show backend history (if your API returns it)
-    if backend_history:
-        with st.expander("Backend conversation history (from API)", expanded=False):
+# Chat input
+user_input = st.chat_input("Type your question here...")
+if not user_input and send_draft:
+    user_input = st.session_state.draft.strip()
+
+if user_input:
+    # Several pasted questions go out together in one /chat/batch call
+    questions = split_questions(user_input)
+    if len(questions) > 1:
+        answer_batch(questions)
+    else:
+        answer_question(questions[0])
+
+# Optional: show backend history (fetched only when asked for)
+if st.session_state.messages:
+    with st.expander("Backend conversation history (from API)", expanded=False):
+        if st.checkbox("Load backend history"):
+            backend_history = []
+            try:
+                r = B.client.get(f"/history/{st.session_state.session_id}", timeout=30)
+                if r.is_success:
+                    backend_history = orjson.loads(r.content)
+                else:
+                    st.markdown(f"⚠️ Backend error {r.status_code}")
+            except httpx.HTTPError as e:
+                st.markdown(f"(Request failed: {e})")
+
             for msg in backend_history:
                 role = msg.get("role", "user")
                 content = msg.get("content", "")
                 st.markdown(f"**{role}:** {content}")
-
-
-# --- Old cloud API override moved & commented ---
-# # for VG task
-# # Before (local function)
-# # API_URL = "http://127.0.0.1:7072/chat"
-#
-# # After (cloud function)
-# API_URL = "https://data-talks-ai-function-e0dhdmchdeawa8g2.swedencentral-01.azurewebsites.net/chat"